@@ -0,0 +1,64 @@
+"""Persistent cache of board unique ids.
+
+A board's unique id never changes, so once a board has been seen the id
+can be served from disk on later process starts instead of paying a
+serial round-trip during driver enumeration.  Entries are keyed by the
+USB serial number of the device on the port (see key_for), NOT the port
+path - the same /dev/ttyACM* can host a different board tomorrow, and a
+path-keyed cache would hand that board the old id.  Lives in the user
+profile so every test-plan run shares it.
+"""
+import json
+import os
+
+from serial.tools import list_ports
+
+CACHE_FILE = os.path.expanduser("~/.prism/id_cache.json")
+
+_cache = None
+
+
+def key_for(port):
+    """Stable cache key for the board currently on port: its USB serial
+    number, or None when there isn't one (no safe key - callers must
+    then ask the board itself)."""
+    for p in list_ports.comports():
+        if p.device == port:
+            return p.serial_number or None
+    return None
+
+
+def _load():
+    global _cache
+    try:
+        with open(CACHE_FILE) as f:
+            _cache = json.load(f)
+    except (OSError, ValueError):
+        _cache = {}
+
+
+def get(key):
+    """Return the cached unique id for key (from key_for), or None."""
+    if key is None:
+        return None
+    if _cache is None:
+        _load()
+    return _cache.get(key)
+
+
+def put(key, unique_id):
+    """Record key -> unique_id, persisting to disk on change."""
+    if key is None:
+        return
+    if _cache is None:
+        _load()
+    if _cache.get(key) == unique_id:
+        return
+    _cache[key] = unique_id
+    try:
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        with open(CACHE_FILE, "w") as f:
+            json.dump(_cache, f)
+    except OSError:
+        # the cache is an optimization; never fail a run over it
+        pass
@@ -0,0 +1,336 @@
+"""Host side driver for a pyboard running upyb_server_01.
+
+Extends ampy's Pyboard with a small RPC layer: commands are dicts of
+the form {"method": name, "args": {...}} which are executed on the
+pyboard by upyb_server_01.server, and results come back as lists of
+{"method": ..., "success": ..., "value": ...} dicts.
+"""
+import binascii
+import contextlib
+import functools
+import json
+import logging
+import struct
+import threading
+
+import numpy
+
+from ampy.pyboard import Pyboard, PyboardError
+from serial.tools import list_ports
+
+import id_cache
+
+
+class pyboard2(Pyboard):
+    """Driver for one pyboard running upyb_server_01."""
+
+    SERVER_MODULE = "upyb_server_01"
+
+    # statement templates, built once at class-definition time so the
+    # hot path only pays one % substitution per command
+    _CMD_TEMPLATE = SERVER_MODULE + ".server.cmd_json(%r)"
+    _RET_TEMPLATE = SERVER_MODULE + ".server.ret(method=%r)"
+    _WAIT_TEMPLATE = SERVER_MODULE + ".server.wait_for(%r, %d)"
+    _PEEK_TEMPLATE = SERVER_MODULE + ".server.peek(method=%r)"
+
+    # first byte of a binary-framed response (see adc_read_multi_bin)
+    ADC_BIN_MAGIC = b'\x02'
+
+    def __init__(self, port, baudrate=115200, loggerIn=None, multithread=False):
+        super(pyboard2, self).__init__(port, baudrate=baudrate)
+        if loggerIn:
+            self.logger = loggerIn
+        else:
+            self.logger = logging.getLogger("pyboard2.{}".format(port))
+        self.port = port
+        # the lock only matters when several threads share this object;
+        # single-owner callers skip the mutex entirely
+        self.lock = threading.Lock()
+        self._lock_ctx = self.lock if multithread else contextlib.nullcontext()
+        self._usb_cdc = self._detect_usb_cdc(port)
+        # the raw REPL handshake costs several serial exchanges; do it
+        # once here and stay in the fast path until close()
+        self.enter_raw_repl()
+        self._repl_open = True
+
+    @staticmethod
+    def _detect_usb_cdc(port):
+        for p in list_ports.comports():
+            if p.device == port:
+                return "USB" in (p.hwid or "")
+        return False
+
+    def exec_raw_no_follow(self, command):
+        """Send a command for execution.
+
+        The stock path writes in 256-byte chunks with a 10ms sleep
+        between them as poor-man's flow control - 160ms of pure sleep
+        for a 4KB batch payload.  USB CDC has real end-to-end flow
+        control and cannot overflow, so there the whole buffer goes
+        down in one write.
+        """
+        if not self._usb_cdc:
+            return super(pyboard2, self).exec_raw_no_follow(command)
+        if isinstance(command, bytes):
+            command_bytes = command
+        else:
+            command_bytes = bytes(command, encoding="utf8")
+        data = self.read_until(1, b">")
+        if not data.endswith(b">"):
+            raise PyboardError("could not enter raw repl")
+        self.serial.write(memoryview(command_bytes))
+        self.serial.write(b"\x04")
+        data = self.serial.read(2)
+        if data != b"OK":
+            raise PyboardError("could not exec command; response: {}".format(data))
+
+    # ------------------------------------------------------------------
+    # transport
+
+    @staticmethod
+    def _iter_results(ret):
+        """Lazily parse JSON-lines exec output into result dicts.
+
+        Works on the raw bytes (json.loads accepts them), one document
+        per line - no whole-buffer decode and no intermediate str list,
+        and callers that stop early never parse the remaining lines.
+        """
+        for line in ret.splitlines():
+            if not line:
+                continue
+            for item in json.loads(line):
+                yield item
+
+    def server_cmd(self, cmds, timeout=10):
+        """Execute a list of python statements on the pyboard.
+
+        Returns (success, items) where items is the parsed list of
+        result dicts printed by the server.
+        """
+        cmd = "\n".join(cmds) + "\n"
+        with self._lock_ctx:
+            ret, ret_err = self.exec_raw(cmd, timeout=timeout)
+
+        if ret_err:
+            self.logger.error(ret_err.decode("utf-8"))
+            return False, ret_err.decode("utf-8")
+
+        if ret[:1] == self.ADC_BIN_MAGIC:
+            # binary frame, hand the raw bytes to the caller's decoder
+            return True, ret
+
+        return True, list(self._iter_results(ret))
+
+    def _cmd_stmt(self, cmd_dict):
+        """Python statement that runs cmd_dict on the device.
+
+        The dict goes down as JSON inside a repr'd string literal, so
+        values containing quotes survive the trip.
+        """
+        return self._CMD_TEMPLATE % json.dumps(cmd_dict)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=32)
+    def _ret_stmt(method):
+        # only a handful of methods exist, so the frozen statements are
+        # effectively computed once each
+        return pyboard2._RET_TEMPLATE % method
+
+    def server_cmd_batch(self, cmd_dicts, timeout=10):
+        """Execute several server commands in ONE REPL round-trip.
+
+        All commands are queued on the device in a single exec, followed
+        by one flush of every queued result, instead of paying a serial
+        round-trip (and possibly a raw-REPL handshake) per command.
+        """
+        cmds = [self._cmd_stmt(d) for d in cmd_dicts]
+        cmds.append(self._ret_stmt('__all__'))
+        return self.server_cmd(cmds, timeout=timeout)
+
+    def pipeline(self):
+        """Context manager that queues commands and flushes them as one
+        batch on exit, e.g.::
+
+            with pyb.pipeline() as p:
+                p.cmd({"method": "led_toggle", "args": {"led": 1, "on": 1}})
+                p.cmd({"method": "led_toggle", "args": {"led": 1, "on": 0}})
+            success, results = p.results
+        """
+        return _Pipeline(self)
+
+    # ------------------------------------------------------------------
+    # RPC helpers
+
+    @staticmethod
+    def _find_method_result(method, success, result):
+        """Reduce a server_cmd response to (success, result-dict) for
+        one method - the shared tail of the fetch helpers below."""
+        if not success:
+            return False, result
+        for r in result:
+            if r.get("method", None) == method:
+                return r.get("success", False), r
+        return False, "no response for method {}".format(method)
+
+    def _verify_single_cmd_ret(self, cmd_dict):
+        """Send one command and return its result.
+
+        server.cmd executes synchronously on the device, so the result
+        is already queued when the ret in the same exec runs - one
+        round-trip, no polling.
+        """
+        method = cmd_dict["method"]
+        cmds = [self._cmd_stmt(cmd_dict), self._ret_stmt(method)]
+        success, result = self.server_cmd(cmds)
+        return self._find_method_result(method, success, result)
+
+    def get_server_method(self, method, timeout_ms=1000):
+        """Fetch (and pop) the queued result of an async method.
+
+        The device blocks in server.wait_for until the result is queued
+        or the timeout expires, so the host does one read instead of
+        sleep-polling.
+        """
+        cmds = [self._WAIT_TEMPLATE % (method, timeout_ms)]
+        success, result = self.server_cmd(cmds, timeout=timeout_ms / 1000 + 10)
+        return self._find_method_result(method, success, result)
+
+    def peek_server_method(self, method):
+        """Like get_server_method but non-blocking, result stays queued."""
+        cmds = [self._PEEK_TEMPLATE % method]
+        success, result = self.server_cmd(cmds)
+        return self._find_method_result(method, success, result)
+
+    def close(self):
+        """Leave the raw REPL and close the serial port.
+
+        The REPL exit is itself a serial write and fails when the board
+        hung or was unplugged - exactly the cases this close runs for -
+        so its failure is logged and the port is closed regardless.
+        """
+        if self._repl_open:
+            self._repl_open = False
+            try:
+                self.exit_raw_repl()
+            except Exception as e:
+                self.logger.warning("exit_raw_repl failed: {}".format(e))
+        super(pyboard2, self).close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        # always leave the raw REPL, even when a test item raised -
+        # a board stuck in raw REPL needs a physical reset to recover
+        self.close()
+        return False
+
+    # ------------------------------------------------------------------
+    # high level API
+
+    def start_server(self):
+        """Import the server module on the pyboard."""
+        return self.server_cmd(["import {}".format(self.SERVER_MODULE)])
+
+    def version(self):
+        return self._verify_single_cmd_ret({"method": "version", "args": {}})
+
+    def unique_id(self):
+        """The board's unique id; served from the on-disk cache when
+        this board has been seen before (keyed by its USB serial
+        number, so a board swap on the same port misses the cache)."""
+        key = id_cache.key_for(self.port)
+        cached = id_cache.get(key)
+        if cached is not None:
+            return True, {"method": "unique_id", "success": True,
+                          "value": cached}
+        success, result = self._verify_single_cmd_ret(
+            {"method": "unique_id", "args": {}})
+        if success:
+            id_cache.put(key, result["value"])
+        return success, result
+
+    def led_toggle(self, led, on=1):
+        return self._verify_single_cmd_ret(
+            {"method": "led_toggle", "args": {"led": led, "on": on}})
+
+    def adc_read(self, pin, samples=1, samples_ms=1):
+        return self._verify_single_cmd_ret(
+            {"method": "adc_read",
+             "args": {"pin": pin, "samples": samples, "samples_ms": samples_ms}})
+
+    def adc_read_multi(self, pins, samples=100, freq=100, reduce=None,
+                       scale_to_vref=False):
+        """Timed multi-pin sampling.
+
+        reduce="stats" makes the device reduce each pin's samples to
+        {mean, min, max, stdev} so only a few dozen bytes come back
+        instead of the full arrays; scale_to_vref returns volts so no
+        host-side scaling loop is needed.
+        """
+        method = "adc_read_stats" if reduce == "stats" else "adc_read_multi"
+        return self._verify_single_cmd_ret(
+            {"method": method,
+             "args": {"pins": pins, "samples": samples, "freq": freq,
+                      "scale_to_vref": scale_to_vref}})
+
+    def adc_read_multi_bin(self, pins, samples=100, freq=100,
+                           scale_to_vref=False):
+        """adc_read_multi over binary framing.
+
+        The device ships the uint16 sample buffers hex-encoded behind a
+        4-byte header instead of JSON (raw bytes would be cut short by
+        the REPL's \x04 end-of-output marker) - well under half the
+        payload and no tokenizer - and the result comes back as a numpy
+        array of shape (n_pins, n_samples), optionally scaled to volts.
+        """
+        cmds = ["%s.server.adc_read_multi_bin(%r, %d, %d)" %
+                (self.SERVER_MODULE, list(pins), samples, freq)]
+        success, ret = self.server_cmd(cmds)
+        if not success:
+            return False, ret
+        if ret[:1] != self.ADC_BIN_MAGIC:
+            return False, "bad binary frame: {!r}".format(ret[:8])
+        payload = binascii.unhexlify(ret[1:].strip())
+        n_pins, n_samples = struct.unpack_from('<HH', payload)
+        arr = numpy.frombuffer(payload, dtype='<u2', count=n_pins * n_samples,
+                               offset=4).reshape(n_pins, n_samples)
+        if scale_to_vref:
+            arr = arr.astype(numpy.float32) * (3.3 / 4095)
+        return True, arr
+
+    def enable_jig_closed_detect(self, enable=True):
+        return self._verify_single_cmd_ret(
+            {"method": "enable_jig_closed_detect", "args": {"enable": enable}})
+
+    def jig_closed_detect(self):
+        return self._verify_single_cmd_ret(
+            {"method": "jig_closed_detect", "args": {}})
+
+
+class _Pipeline(object):
+    """Queues command dicts and flushes them as one server_cmd_batch."""
+
+    def __init__(self, pyb):
+        self._pyb = pyb
+        self._cmds = []
+        self.results = (False, [])
+
+    def cmd(self, cmd_dict):
+        self._cmds.append(cmd_dict)
+
+    def led_toggle(self, led, on=1):
+        self.cmd({"method": "led_toggle", "args": {"led": led, "on": on}})
+
+    def adc_read(self, pin, samples=1, samples_ms=1):
+        self.cmd({"method": "adc_read",
+                  "args": {"pin": pin, "samples": samples,
+                           "samples_ms": samples_ms}})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        if exc_type is None and self._cmds:
+            self.results = self._pyb.server_cmd_batch(self._cmds)
+        return False
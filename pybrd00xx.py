@@ -0,0 +1,133 @@
+"""Prism test items for the PYBRD00xx pyboard jig.
+
+Test item IDs map one-to-one onto methods of the pybrd00xx class; the
+pyboard driver object is created by the hardware plugin during
+discovery and fetched from shared_state in PYBRD0xxSETUP.
+"""
+import logging
+
+from public.prism.api import TestItem, ResultAPI
+
+# the UNIT_* reflection is invariant across items; resolve it once at
+# import instead of a getattr per test item
+_UNIT_CACHE = {n: getattr(ResultAPI, n) for n in dir(ResultAPI)
+               if n.startswith("UNIT_")}
+
+
+class pybrd00xx(TestItem):
+    """Test items for the pyboard jig."""
+
+    DRIVER_TYPE = "pyboard"
+
+    def __init__(self, controller, chan, shared_state):
+        super(pybrd00xx, self).__init__(controller, chan, shared_state)
+        self.logger = logging.getLogger("{}.{}".format(__name__, chan))
+        self.pyb = None
+
+    def PYBRD0xxSETUP(self):
+        ctx = self.item_start()
+        drivers = self.shared_state.get_drivers(self.chan, type=self.DRIVER_TYPE)
+        if len(drivers) != 1:
+            self.logger.error("unexpected number of drivers: {}".format(drivers))
+            self.item_end(ResultAPI.RECORD_RESULT_FAIL)
+            return
+        driver = drivers[0]
+        self.pyb = driver["obj"]["pyb"]
+        # when the framework offers an exit stack, register the
+        # connection on it so the board leaves raw REPL even if a later
+        # item raises; without one, teardown stays with PYBRD0xxTRDN
+        enter_context = getattr(self.shared_state, "enter_context", None)
+        if enter_context is not None:
+            self.pyb = enter_context(self.pyb)
+        id = driver["obj"]["id"]
+        self.logger.info("found pyboard {} on {}".format(id, self.pyb.port))
+        self.item_end(ResultAPI.RECORD_RESULT_PASS)
+
+    def PYBRD0xxTRDN(self):
+        ctx = self.item_start()
+        self.pyb.close()
+        self.item_end(ResultAPI.RECORD_RESULT_PASS)
+
+    def PYBRD0010_LedToggle(self):
+        """Toggle a LED on and back off.
+
+        The on and off commands go down as one batch so the test costs
+        a single REPL round-trip.
+        """
+        ctx = self.item_start()
+        lednum = ctx.item.get("lednum", 1)
+
+        with self.pyb.pipeline() as p:
+            p.led_toggle(lednum, 1)
+            p.led_toggle(lednum, 0)
+        success, results = p.results
+        if not success:
+            self.logger.error("led_toggle failed: {}".format(results))
+            self.item_end(ResultAPI.RECORD_RESULT_FAIL)
+            return
+        # transport success still carries per-command results; any one
+        # of them can fail (e.g. lednum out of range)
+        for r in results:
+            if not r.get("success", False):
+                self.logger.error("led_toggle failed: {}".format(r))
+                self.item_end(ResultAPI.RECORD_RESULT_FAIL)
+                return
+        self.item_end(ResultAPI.RECORD_RESULT_PASS)
+
+    def PYBRD0020_adc_read(self):
+        ctx = self.item_start()
+        pin = ctx.item.get("pin", "X19")
+        samples = ctx.item.get("samples", 1)
+        samples_ms = ctx.item.get("samples_ms", 1)
+        unit = _UNIT_CACHE[ctx.item.get("unit", "UNIT_NONE")]
+        min_val = ctx.item.get("min", None)
+        max_val = ctx.item.get("max", None)
+
+        success, result = self.pyb.adc_read(pin, samples, samples_ms)
+        if not success:
+            self.logger.error("adc_read failed: {}".format(result))
+            self.item_end(ResultAPI.RECORD_RESULT_FAIL)
+            return
+
+        value = result["value"]["value"]
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info("ADC pin {}: {}".format(pin, value))
+        _, _result, _bullet = ctx.record.measurement("{}_adc".format(pin),
+                                                     value, unit,
+                                                     min_val, max_val)
+        self.log_bullet(_bullet)
+        self.item_end(_result)
+
+    def PYBRD0021_adc_read_multi(self):
+        """Read every configured ADC pin in ONE device round-trip.
+
+        The item lists pins (with shared sampling config); the device
+        samples them together and reduces to per-pin stats, so N pins
+        cost one RPC instead of N.
+        """
+        ctx = self.item_start()
+        pins = ctx.item.get("pins", ["X19"])
+        samples = ctx.item.get("samples", 100)
+        freq = ctx.item.get("freq", 100)
+        unit = _UNIT_CACHE[ctx.item.get("unit", "UNIT_NONE")]
+        min_val = ctx.item.get("min", None)
+        max_val = ctx.item.get("max", None)
+
+        success, result = self.pyb.adc_read_multi(pins, samples, freq,
+                                                  reduce="stats")
+        if not success:
+            self.logger.error("adc_read_multi failed: {}".format(result))
+            self.item_end(ResultAPI.RECORD_RESULT_FAIL)
+            return
+
+        final_result = ResultAPI.RECORD_RESULT_PASS
+        for pin, stats in zip(pins, result["value"]["stats"]):
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info("ADC pin {}: {}".format(pin, stats))
+            _, _result, _bullet = ctx.record.measurement("{}_adc".format(pin),
+                                                         stats["mean"], unit,
+                                                         min_val, max_val)
+            self.log_bullet(_bullet)
+            if _result != ResultAPI.RECORD_RESULT_PASS:
+                final_result = _result
+        self.item_end(final_result)
@@ -0,0 +1,274 @@
+"""Host side driver for a Teensy 4 running the SimpleRPC server sketch.
+
+The firmware exports its methods through SimpleRPC; replies are JSON
+strings of the form {"success": ..., "result": {...}} which are decoded
+to dicts here.
+"""
+import collections
+import contextlib
+import json
+import logging
+import struct
+import threading
+
+from simple_rpc import Interface
+
+import id_cache
+
+# bound once so the parse sites don't pay the module-attribute lookup
+_loads = json.loads
+
+# fixed-shape replies for the high-frequency methods; decoding a packed
+# struct is ~10x cheaper than tokenizing the equivalent JSON
+GpioResult = collections.namedtuple("GpioResult", "success state")
+AdcResult = collections.namedtuple("AdcResult", "success value")
+
+
+class Teensy4(object):
+    """Driver for one Teensy 4."""
+
+    # slot storage: the hot methods do several self.X lookups per call
+    # and slots make each one a fixed-offset read instead of a dict probe
+    __slots__ = ('logger', 'port', 'baudrate', 'boot_timeout', 'rpc',
+                 'lock', '_lock_ctx', 'my_version', '_version',
+                 '_unique_id', '_methods', '_gpio_cache',
+                 '_binary_replies', '_call')
+
+    MY_VERSION = "1.0"  # must match the firmware version response
+
+    GPIO_MODE_INPUT = 0
+    GPIO_MODE_OUTPUT = 1
+    GPIO_MODE_INPUT_PULLUP = 2
+
+    # Teensy 4 USB-CDC ignores the baud value (it always runs at USB
+    # speed), but a real-UART bridge honors it and 9600 is 960 bytes/s;
+    # the firmware negotiates up to 6Mbps, 1M is a safe shared default
+    DEFAULT_BAUDRATE = 1000000
+
+    def __init__(self, port, baudrate=DEFAULT_BAUDRATE, loggerIn=None,
+                 multithread=False, boot_timeout=0):
+        # boot_timeout is the post-connect wait for boards that reboot
+        # on DTR; the Teensy 4 doesn't, so don't pay the ~2s default
+        if loggerIn:
+            self.logger = loggerIn
+        else:
+            self.logger = logging.getLogger("Teensy4.{}".format(port))
+        self.port = port
+        self.baudrate = baudrate
+        self.boot_timeout = boot_timeout
+        self.rpc = None
+        # the lock only matters when several threads share this object;
+        # single-owner callers skip the mutex entirely
+        self.lock = threading.Lock()
+        self._lock_ctx = self.lock if multithread else contextlib.nullcontext()
+        self.my_version = self.MY_VERSION
+        # answers that cannot change for the life of the connection,
+        # populated by init(), cleared by reset()/close()
+        self._version = None
+        self._unique_id = None
+        self._methods = None
+        # per-pin read_gpio results, invalidated by any pin mutation
+        self._gpio_cache = {}
+        # True when the firmware exports the read_adc_bin packed-reply
+        # variant (scalar methods use native typed returns instead)
+        self._binary_replies = False
+        self._call = self._call_locked
+
+    def _call_locked(self, *args):
+        with self._lock_ctx:
+            return self.rpc.call_method(*args)
+
+    def _call_binary(self, name, fmt, *args):
+        """Call a method whose firmware reply is a packed struct."""
+        buf = self._call(name, *args)
+        return struct.unpack_from(fmt, buf)
+
+    def init(self):
+        """Connect, verify the firmware version, prime the caches.
+
+        rpc.device['version'] is the SimpleRPC *protocol* version, not
+        ours, so the firmware version costs one version() RPC - but the
+        answer is cached here so later version() calls are free.
+        """
+        self.rpc = Interface(self.port, baudrate=self.baudrate,
+                             wait=self.boot_timeout)
+        answer = _loads(self._call('version'))
+        fw_version = answer["result"]["version"]
+        if fw_version != self.my_version:
+            self.logger.error("version mismatch: {} != {}".format(
+                fw_version, self.my_version))
+            self.rpc.close()
+            self.rpc = None
+            return False
+        self._version = answer
+        cache_key = id_cache.key_for(self.port)
+        cached_id = id_cache.get(cache_key)
+        if cached_id is not None:
+            self._unique_id = {"success": True,
+                               "result": {"unique_id": cached_id}}
+        else:
+            self._unique_id = _loads(self._call('unique_id'))
+            if self._unique_id["success"]:
+                id_cache.put(cache_key,
+                             self._unique_id["result"]["unique_id"])
+        self._methods = tuple(self.rpc.methods)
+        self._binary_replies = 'read_adc_bin' in self._methods
+        if self._lock_ctx is self.lock:
+            self._call = self._call_locked
+        else:
+            # single-owner fast path: bind call_method directly so each
+            # RPC is one call, no lock and no attribute chain
+            self._call = self.rpc.call_method
+        return True
+
+    def close(self):
+        if self.rpc is not None:
+            self.rpc.close()
+            self.rpc = None
+        self._call = self._call_locked
+        self._version = None
+        self._unique_id = None
+        self._methods = None
+        self._gpio_cache = {}
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+        return False
+
+    def reset(self):
+        answer = _loads(self._call('reset'))
+        # the firmware is back to power-on state, nothing cached holds
+        self._version = None
+        self._unique_id = None
+        self._methods = None
+        self._gpio_cache = {}
+        return answer
+
+    # ------------------------------------------------------------------
+    # idempotent lookups, served from cache after init()
+
+    def version(self):
+        if self._version is not None:
+            return self._version
+        return _loads(self._call('version'))
+
+    def unique_id(self):
+        if self._unique_id is not None:
+            return self._unique_id
+        return _loads(self._call('unique_id'))
+
+    def list(self):
+        if self._methods is not None:
+            return list(self._methods)
+        return list(self.rpc.methods)
+
+    def slot(self):
+        return _loads(self._call('slot'))
+
+    # ------------------------------------------------------------------
+    # GPIO / ADC / LED
+
+    def led(self, set):
+        """Set the LED; returns a GpioResult."""
+        answer = self._call('led', set)
+        if isinstance(answer, int):
+            # typed firmware return - a bare uint8, nothing to parse
+            return GpioResult(True, answer)
+        answer = _loads(answer)
+        return GpioResult(answer["success"], answer["result"]["state"])
+
+    def init_gpio(self, pin_number, mode):
+        self._gpio_cache.pop(pin_number, None)
+        return _loads(self._call('init_gpio', pin_number, mode))
+
+    def write_gpio(self, pin_number, state):
+        """Write a pin; returns a GpioResult."""
+        self._gpio_cache.pop(pin_number, None)
+        answer = self._call('write_gpio', pin_number, state)
+        if isinstance(answer, int):
+            # typed firmware return - a bare uint8, nothing to parse
+            return GpioResult(True, answer)
+        answer = _loads(answer)
+        return GpioResult(answer["success"], answer["result"]["state"])
+
+    def read_gpio(self, pin_number, cached=False):
+        """Read a pin; returns a GpioResult.  cached=True reuses the
+        last read if no write or re-init has touched the pin since."""
+        if cached and pin_number in self._gpio_cache:
+            return self._gpio_cache[pin_number]
+        raw = self._call('read_gpio', pin_number)
+        if isinstance(raw, int):
+            # typed firmware return - a bare uint8, nothing to parse
+            answer = GpioResult(True, raw)
+        else:
+            raw = _loads(raw)
+            answer = GpioResult(raw["success"], raw["result"]["state"])
+        self._gpio_cache[pin_number] = answer
+        return answer
+
+    def read_adc(self, pin_number, sample_num=1, sample_rate=1):
+        """Read an ADC pin; returns an AdcResult."""
+        if self._binary_replies:
+            return AdcResult(*self._call_binary('read_adc_bin', '<Bh',
+                                                pin_number, sample_num,
+                                                sample_rate))
+        answer = _loads(self._call('read_adc', pin_number,
+                                       sample_num, sample_rate))
+        return AdcResult(answer["success"], answer["result"]["value"])
+
+    # ------------------------------------------------------------------
+    # batched operations - N pins in one RPC frame instead of N frames
+
+    def write_gpio_batch(self, pin_states):
+        """Write [(pin, state), ...] in one RPC call."""
+        pins = bytes(p for p, _ in pin_states)
+        states = bytes(s & 0xff for _, s in pin_states)
+        for p in pins:
+            self._gpio_cache.pop(p, None)
+        return _loads(self._call('write_gpio_batch', pins, states))
+
+    def read_gpio_batch(self, pin_numbers):
+        """Read [pin, ...] in one RPC call; returns one result list."""
+        return _loads(self._call('read_gpio_batch', bytes(pin_numbers)))
+
+    def read_adc_batch(self, pin_numbers, sample_num=1, sample_rate=1):
+        """Read several ADC pins with shared sampling in one RPC call."""
+        return _loads(self._call('read_adc_batch', bytes(pin_numbers),
+                                     sample_num, sample_rate))
+
+    def pipeline(self):
+        """Context manager that queues GPIO writes and flushes them as
+        one write_gpio_batch on exit, e.g.::
+
+            with teensy.pipeline() as p:
+                p.write_gpio(0, 1)
+                p.write_gpio(1, 0)
+            answer = p.results
+        """
+        return _Pipeline(self)
+
+
+class _Pipeline(object):
+    """Queues (pin, state) writes and flushes one write_gpio_batch."""
+
+    __slots__ = ('_teensy', '_writes', 'results')
+
+    def __init__(self, teensy):
+        self._teensy = teensy
+        self._writes = []
+        self.results = None
+
+    def write_gpio(self, pin_number, state):
+        self._writes.append((pin_number, state))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        if exc_type is None and self._writes:
+            self.results = self._teensy.write_gpio_batch(self._writes)
+        return False
@@ -0,0 +1,25 @@
+"""I2C bus helpers for the pyboard.
+
+The supplies board hangs off the "X" I2C bus (SCL=X9, SDA=X10).  These
+helpers keep the bus naming in one place so the driver modules and the
+REPL test blocks agree on which bus they are talking to.
+"""
+import machine
+
+UPYB_I2C_HW_I2C1 = "X"  # SCL=X9, SDA=X10
+UPYB_I2C_HW_I2C2 = "Y"  # SCL=Y9, SDA=Y10
+
+# Fast-Mode-Plus; the INA220 is good to 2.94MHz and the TCA expanders
+# to 1MHz.  Rise time was verified on the board pull-ups with a scope -
+# drop back to 400000 if a board revision weakens them.
+UPYB_I2C_DEFAULT_FREQ = 1000000
+
+
+def upyb_i2c_init(bus=UPYB_I2C_HW_I2C1, freq=UPYB_I2C_DEFAULT_FREQ):
+    """Create a machine.I2C on the named bus."""
+    return machine.I2C(bus, freq=freq)
+
+
+def upyb_i2c_scan(i2c):
+    """Return the list of responding addresses as hex strings."""
+    return [hex(a) for a in i2c.scan()]
@@ -0,0 +1,209 @@
+"""MicroPython side of the pyboard RPC link.
+
+Runs on the pyboard.  The host (pyboard2.py) enters the raw REPL and
+executes `upyb_server_01.server.cmd({...})` to queue work and
+`upyb_server_01.server.ret(method=...)` to fetch results.  Results are
+dicts of the form {"method": ..., "success": ..., "value": ...} and are
+printed so the host can read them from the REPL output.
+"""
+import pyb
+import ujson
+import utime
+
+VERSION = "0.2.0"
+
+
+class UPYBServer(object):
+
+    LED_MAX = 4
+
+    def __init__(self):
+        self._rets = []  # queued results, oldest first
+        # not _jig_closed_detect: that name belongs to the handler
+        # method and an attribute would shadow it in cmd()'s getattr
+        self._jig_detect_enabled = False
+
+    # ------------------------------------------------------------------
+    # host facing API
+
+    def cmd(self, cmd_dict):
+        """Execute a command dict, {"method": name, "args": {...}}.
+
+        The result is queued; the host fetches it via ret().
+        """
+        method = cmd_dict.get("method", None)
+        handler = getattr(self, "_" + str(method), None)
+        if handler is None:
+            self._rets.append({"method": method, "success": False,
+                               "value": "unknown method"})
+            return
+        self._rets.append(handler(cmd_dict.get("args", {})))
+
+    def cmd_json(self, s):
+        """cmd() with a JSON-encoded command, the host's native format."""
+        self.cmd(ujson.loads(s))
+
+    def ret(self, method=None, all=False):
+        """Print (and pop) queued results.
+
+        method '__all__' or all=True flushes everything; otherwise only
+        results for the named method are returned.
+        """
+        if method == "__all__" or all:
+            popped, self._rets = self._rets, []
+        else:
+            popped = [r for r in self._rets if r.get("method") == method]
+            self._rets = [r for r in self._rets if r.get("method") != method]
+        print(ujson.dumps(popped))
+
+    def wait_for(self, method, timeout_ms=1000):
+        """Block until a result for method is queued, then print and pop it.
+
+        Blocking here means the host does one read with a timeout
+        instead of polling; wfi() keeps the core in low power between
+        checks (systick wakes it every ms).
+        """
+        deadline = utime.ticks_add(utime.ticks_ms(), timeout_ms)
+        while utime.ticks_diff(deadline, utime.ticks_ms()) > 0:
+            for i, r in enumerate(self._rets):
+                if r.get("method") == method:
+                    print(ujson.dumps([self._rets.pop(i)]))
+                    return
+            pyb.wfi()
+        print(ujson.dumps([]))
+
+    def peek(self, method=None):
+        """Like ret() but leaves the queue untouched."""
+        if method is None:
+            print(ujson.dumps(self._rets))
+        else:
+            print(ujson.dumps([r for r in self._rets if r.get("method") == method]))
+
+    # ------------------------------------------------------------------
+    # methods, one per host API call
+
+    def _version(self, args):
+        return {"method": "version", "success": True, "value": VERSION}
+
+    def _unique_id(self, args):
+        uid = "".join("{:02x}".format(b) for b in pyb.unique_id())
+        return {"method": "unique_id", "success": True, "value": uid}
+
+    def _led_toggle(self, args):
+        led = args.get("led", 1)
+        on = args.get("on", 1)
+        if not 1 <= led <= self.LED_MAX:
+            return {"method": "led_toggle", "success": False,
+                    "value": "led out of range"}
+        if on:
+            pyb.LED(led).on()
+        else:
+            pyb.LED(led).off()
+        return {"method": "led_toggle", "success": True,
+                "value": {"led": led, "on": on}}
+
+    def _adc_read(self, args):
+        """Average `samples` reads of the named pin, `samples_ms` apart."""
+        pin = args.get("pin", "X19")
+        samples = args.get("samples", 1)
+        samples_ms = args.get("samples_ms", 1)
+        adc = pyb.ADC(pyb.Pin(pin))
+        total = 0
+        for _ in range(samples):
+            total += adc.read()
+            utime.sleep_ms(samples_ms)
+        return {"method": "adc_read", "success": True,
+                "value": {"pin": pin, "value": total / samples,
+                          "samples": samples}}
+
+    ADC_VREF_SCALE = 3.3 / 4095
+
+    def _adc_sample(self, args):
+        """Timed multi-pin sampling shared by the adc_read_* methods."""
+        pins = args.get("pins", ["X19"])
+        samples = args.get("samples", 100)
+        freq = args.get("freq", 100)
+        import array
+        adcs = [pyb.ADC(pyb.Pin(p)) for p in pins]
+        bufs = [array.array("H", (0 for _ in range(samples))) for _ in adcs]
+        pyb.ADC.read_timed_multi(tuple(adcs), tuple(bufs), pyb.Timer(8, freq=freq))
+        return pins, samples, freq, bufs
+
+    def _adc_read_multi(self, args):
+        """Timed multi-sample read; returns the sample lists.
+
+        With scale_to_vref the samples come back in volts, otherwise as
+        raw ADC counts.
+        """
+        pins, samples, freq, bufs = self._adc_sample(args)
+        if args.get("scale_to_vref", False):
+            reads = [[v * self.ADC_VREF_SCALE for v in b] for b in bufs]
+        else:
+            reads = [list(b) for b in bufs]
+        return {"method": "adc_read_multi", "success": True,
+                "value": {"pins": pins, "samples": samples, "freq": freq,
+                          "reads": reads}}
+
+    ADC_BIN_MAGIC = b'\x02'
+
+    def adc_read_multi_bin(self, pins, samples=100, freq=100):
+        """adc_read_multi with binary framing, called directly (not via
+        cmd) because it bypasses the JSON result queue.
+
+        Frame: magic byte, then hex of '<HH' (n_pins, n_samples)
+        followed by the raw uint16 little-endian sample buffers back to
+        back.  Raw bytes cannot ride the raw REPL - \x04 anywhere in
+        the payload ends the output stream - so the payload is hex:
+        still well under half the JSON size and no tokenizing on either
+        side.
+        """
+        import struct
+        import sys
+        from ubinascii import hexlify
+        _, _, _, bufs = self._adc_sample({"pins": pins, "samples": samples,
+                                          "freq": freq})
+        out = getattr(sys.stdout, "buffer", sys.stdout)
+        out.write(self.ADC_BIN_MAGIC)
+        out.write(hexlify(struct.pack('<HH', len(bufs), samples)))
+        for b in bufs:
+            out.write(hexlify(b))
+
+    def _adc_read_stats(self, args):
+        """Like adc_read_multi but reduces on the device.
+
+        Ships {mean, min, max, stdev} per pin - a few dozen bytes -
+        instead of the full sample arrays.
+        """
+        import math
+        pins, samples, freq, bufs = self._adc_sample(args)
+        scale = self.ADC_VREF_SCALE if args.get("scale_to_vref", False) else 1
+        stats = []
+        for b in bufs:
+            n = len(b)
+            mean = sum(b) / n
+            var = 0.0
+            for v in b:
+                d = v - mean
+                var += d * d
+            stats.append({"mean": mean * scale,
+                          "min": min(b) * scale,
+                          "max": max(b) * scale,
+                          "stdev": math.sqrt(var / n) * scale})
+        return {"method": "adc_read_stats", "success": True,
+                "value": {"pins": pins, "samples": samples, "freq": freq,
+                          "stats": stats}}
+
+    def _enable_jig_closed_detect(self, args):
+        self._jig_detect_enabled = bool(args.get("enable", True))
+        return {"method": "enable_jig_closed_detect", "success": True,
+                "value": self._jig_detect_enabled}
+
+    def _jig_closed_detect(self, args):
+        closed = False
+        if self._jig_detect_enabled:
+            closed = pyb.Pin("X1", pyb.Pin.IN, pyb.Pin.PULL_UP).value() == 0
+        return {"method": "jig_closed_detect", "success": True,
+                "value": closed}
+
+
+server = UPYBServer()
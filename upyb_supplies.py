@@ -0,0 +1,513 @@
+"""MicroPython drivers for the supplies board.
+
+Two INA220 current monitors sit behind a GPIO-expander driven relay mux
+so either monitor can be switched across the V1/V2/V3 supply rails.  A
+second expander controls the programmable LDOs.  Everything is on the
+same 400kHz I2C bus.
+
+Classes:
+    INA220      - one current/voltage monitor
+    SupplyStats - the relay mux plus both INA220s, returns per-rail stats
+    LDO         - programmable LDO enable/voltage-select
+    Supplies    - top level container, one per board
+"""
+import utime
+import machine
+
+DEBUG = False
+
+
+class INA220(object):
+    """TI INA220 shunt/bus voltage monitor.
+
+    The device is run in triggered mode; writing the configuration
+    register starts a conversion and the CNVR bit in the bus voltage
+    register indicates completion.
+    """
+    DEBUG = False
+
+    # scope trigger helper on X3, shared by all instances; only created
+    # (and toggled around the shunt read) when SCOPE_DEBUG is set
+    SCOPE_DEBUG = False
+    _scope_pin = None
+
+    # register pointers
+    INA220_CONFIG = 0x00
+    INA220_SV     = 0x01  # shunt voltage
+    INA220_BV     = 0x02  # bus voltage
+    INA220_PW     = 0x03  # power
+    INA220_CU     = 0x04  # current
+    INA220_CAL    = 0x05  # calibration
+
+    # writing the reset bit on top of the power-on default config
+    INA220_CONFIG_RESET_VALUE   = 0xB99F
+    INA220_CONFIG_DEFAULT_VALUE = 0x399F
+
+    INA220_CONFIG_BVOLTAGERANGE_16V = 0x0000
+    INA220_CONFIG_BVOLTAGERANGE_32V = 0x2000
+
+    INA220_CONFIG_GAIN_1_40MV  = 0x0000
+    INA220_CONFIG_GAIN_2_80MV  = 0x0800
+    INA220_CONFIG_GAIN_4_160MV = 0x1000
+    INA220_CONFIG_GAIN_8_320MV = 0x1800
+
+    # bus ADC 12 bit, field value before shifting into bits 10-7
+    INA220_CONFIG_BADCRES_12BIT = 0x8
+
+    # shunt ADC sample averaging (12 bit), field value before shifting
+    # into bits 6-3, 1 to 64 samples
+    SAMPLES_1  = 0x8
+    SAMPLES_2  = 0x9
+    SAMPLES_4  = 0xA
+    SAMPLES_8  = 0xB
+    SAMPLES_16 = 0xC
+    SAMPLES_32 = 0xD
+    SAMPLES_64 = 0xE
+
+    INA220_CONFIG_MODE_MASK                 = 0x7
+    INA220_CONFIG_MODE_POWERDOWN            = 0x0
+    INA220_CONFIG_MODE_SVOLT_TRIGGERED      = 0x1
+    INA220_CONFIG_MODE_BVOLT_TRIGGERED      = 0x2
+    INA220_CONFIG_MODE_SANDBVOLT_TRIGGERED  = 0x3
+    INA220_CONFIG_MODE_ADCOFF               = 0x4
+    INA220_CONFIG_MODE_SVOLT_CONTINUOUS     = 0x5
+    INA220_CONFIG_MODE_BVOLT_CONTINUOUS     = 0x6
+    INA220_CONFIG_MODE_SANDBVOLT_CONTINUOUS = 0x7
+
+    INA220_SHUNT_CONVERSION_FACTOR = 0.01  # mV per LSB (10uV)
+
+    _MODE_NAMES = {
+        INA220_CONFIG_MODE_SANDBVOLT_CONTINUOUS: "continuous shunt+bus",
+        INA220_CONFIG_MODE_SVOLT_CONTINUOUS:     "continuous shunt",
+        INA220_CONFIG_MODE_BVOLT_CONTINUOUS:     "continuous bus",
+        INA220_CONFIG_MODE_SANDBVOLT_TRIGGERED:  "triggered shunt+bus",
+        INA220_CONFIG_MODE_SVOLT_TRIGGERED:      "triggered shunt",
+        INA220_CONFIG_MODE_BVOLT_TRIGGERED:      "triggered bus",
+        INA220_CONFIG_MODE_ADCOFF:               "adc off",
+        INA220_CONFIG_MODE_POWERDOWN:            "powerdown",
+    }
+
+    # total conversion time in us per averaging setting, indexed by
+    # (SAMPLES - SAMPLES_1), from the INA220 datasheet (12 bit, 532us
+    # per sample)
+    _CONV_TIME_US = (532, 1060, 2130, 4260, 8510, 17000, 34000)
+
+    # margin subtracted from the predicted wait so the tight poll below
+    # catches the CNVR edge rather than overshooting it
+    _CONV_MARGIN_US = 50
+
+    def __init__(self, i2c, addr, name, rsense=0.1, samples=SAMPLES_1,
+                 mode=INA220_CONFIG_MODE_SANDBVOLT_TRIGGERED):
+        self.INA220_I2C = i2c
+        self.INA220_ADDRESS = addr
+        self.name = name
+        self.rsense = rsense  # ohms
+        self.SAMPLES = samples
+        self.MODE = mode
+
+        self.config_register = (self.INA220_CONFIG_BVOLTAGERANGE_16V |
+                                self.INA220_CONFIG_GAIN_1_40MV |
+                                (self.INA220_CONFIG_BADCRES_12BIT << 7) |
+                                (self.SAMPLES << 3) |
+                                self.MODE)
+
+        self._trigger_us = utime.ticks_us()
+
+        # fold the conversion factor and the sense resistor into one
+        # multiply; bus LSB is 4mV
+        self._current_scale = self.INA220_SHUNT_CONVERSION_FACTOR / rsense
+        self._vbus_scale = 0.004
+
+        # the config value never changes after init, encode it once;
+        # dynamic writes reuse a scratch buffer instead of allocating
+        self._config_bytes = bytes([(self.config_register >> 8) & 0xFF,
+                                    self.config_register & 0xFF])
+        self._w_scratch = bytearray(2)
+
+        # read buffers, filled in place by readfrom_mem_into so no
+        # bytes object is allocated per register read
+        self._rbuf2 = bytearray(2)
+        self._rbuf4 = bytearray(4)
+        self._rbuf8 = bytearray(8)
+
+        # pyb.I2C exposes mem_read/mem_write, which skip the machine.I2C
+        # compatibility layer's per-call argument validation; bind the
+        # fast paths once when the bus supports them
+        if hasattr(i2c, "mem_read"):
+            self._read_into = self._read_into_pyb
+            self._write_buf = self._write_buf_pyb
+
+        self._init_config()
+        self._last_config = self.config_register
+
+    def _scope(self, value):
+        if not self.SCOPE_DEBUG:
+            return
+        if INA220._scope_pin is None:
+            INA220._scope_pin = machine.Pin("X3", machine.Pin.OUT)
+        INA220._scope_pin.value(value)
+
+    def _read_into(self, reg_addr, buf):
+        self.INA220_I2C.readfrom_mem_into(self.INA220_ADDRESS, reg_addr, buf)
+
+    def _read_into_pyb(self, reg_addr, buf):
+        self.INA220_I2C.mem_read(buf, self.INA220_ADDRESS, reg_addr)
+
+    def _write_buf(self, reg_addr, buf):
+        self.INA220_I2C.writeto_mem(self.INA220_ADDRESS, reg_addr, buf)
+
+    def _write_buf_pyb(self, reg_addr, buf):
+        self.INA220_I2C.mem_write(buf, self.INA220_ADDRESS, reg_addr)
+
+    def read_word(self, reg_addr):
+        raw = self._rbuf2
+        self._read_into(reg_addr, raw)
+        return (raw[0] << 8) | raw[1]
+
+    def write_word(self, reg_addr, value):
+        self._w_scratch[0] = (value >> 8) & 0xFF
+        self._w_scratch[1] = value & 0xFF
+        self._write_buf(reg_addr, self._w_scratch)
+
+    def _init_config(self):
+        """Reset then configure, with a single verifying readback.
+
+        The reset-value readback is skipped on purpose: the config
+        write that follows would mask a failed reset anyway, so the one
+        config verify covers both writes.
+        """
+        self.write_word(self.INA220_CONFIG, self.INA220_CONFIG_RESET_VALUE)
+        self.write_word(self.INA220_CONFIG, self.config_register)
+        read_config = self.read_word(self.INA220_CONFIG)
+        if read_config != self.config_register:
+            print("{}: _init_config failed, config 0x{:04x}".format(self.name, read_config))
+            return False
+        self.config_explain(read_config)
+        return True
+
+    def read_config(self):
+        return self.read_word(self.INA220_CONFIG)
+
+    def config_explain(self, read_config):
+        """Debug helper, names the operating mode of a config value."""
+        if not self.DEBUG:
+            return
+        mode_name = self._MODE_NAMES.get(read_config & self.INA220_CONFIG_MODE_MASK,
+                                         "unknown")
+        print("{}: config 0x{:04x} mode {}".format(self.name, read_config, mode_name))
+
+    def _trigger(self):
+        # in the continuous modes (0x5-0x7) conversions are free-running
+        # and the config write is redundant unless the value changed
+        if (self.config_register & self.INA220_CONFIG_MODE_MASK) >= self.INA220_CONFIG_MODE_SVOLT_CONTINUOUS:
+            if self._last_config != self.config_register:
+                self.write_word(self.INA220_CONFIG, self.config_register)
+                self._last_config = self.config_register
+            self._trigger_us = utime.ticks_us()
+            return
+        # in the triggered modes rewriting the configuration register is
+        # what starts the conversion, so the write cannot be skipped
+        self._write_buf(self.INA220_CONFIG, self._config_bytes)
+        self._last_config = self.config_register
+        self._trigger_us = utime.ticks_us()
+
+    def _conversion_ready(self):
+        """Wait for the triggered conversion to complete.
+
+        Sleeps out the predicted conversion time for the configured
+        averaging (less a small margin), then polls the CNVR bit
+        tightly.  Returns (ready, bus_volts).
+        """
+        expected_us = self._CONV_TIME_US[self.SAMPLES - self.SAMPLES_1]
+        elapsed_us = utime.ticks_diff(utime.ticks_us(), self._trigger_us)
+        remaining_us = expected_us - self._CONV_MARGIN_US - elapsed_us
+        if remaining_us > 0:
+            utime.sleep_us(remaining_us)
+
+        # give the device up to 2x the expected conversion time overall
+        # before declaring a timeout
+        for _ in range(expected_us // 50 + 20):
+            vbus_reg = self.read_word(self.INA220_BV)
+            if vbus_reg & 0x2:
+                return True, (vbus_reg >> 3) * self._vbus_scale
+            utime.sleep_us(50)
+
+        if self.DEBUG:
+            print("{}: _conversion_ready timeout".format(self.name))
+        return False, 0
+
+    def read_bus_voltage(self):
+        """Trigger and read the bus voltage, in volts."""
+        self._trigger()
+        _, volt = self._conversion_ready()
+        return volt
+
+    def read_shunt_voltage(self):
+        """Trigger and read the shunt voltage, in mV."""
+        self._scope(1)
+        self._trigger()
+        self._conversion_ready()
+        _vshunt = self.read_word(self.INA220_SV)
+        # branchless two's-complement sign extension
+        vshunt = _vshunt - ((_vshunt & 0x8000) << 1)
+        vshunt *= self.INA220_SHUNT_CONVERSION_FACTOR
+        self._scope(0)
+        return vshunt
+
+    def read_sv_bv(self):
+        """Trigger and read shunt (mV) and bus (V) in one transaction.
+
+        The INA220 auto-increments its register pointer, so one 4-byte
+        read starting at the shunt register returns both registers with
+        a single START/STOP pair.
+        """
+        self._trigger()
+        self._conversion_ready()
+        raw = self._rbuf4
+        self._read_into(self.INA220_SV, raw)
+        _vshunt = (raw[0] << 8) | raw[1]
+        vbus_reg = (raw[2] << 8) | raw[3]
+        # branchless two's-complement sign extension
+        vshunt = _vshunt - ((_vshunt & 0x8000) << 1)
+        vshunt *= self.INA220_SHUNT_CONVERSION_FACTOR
+        volt = (vbus_reg >> 3) * self._vbus_scale
+        return vshunt, volt
+
+    def read_all(self):
+        """Read SV/BV/PW/CU raw register values in one 8-byte burst."""
+        b = self._rbuf8
+        self._read_into(self.INA220_SV, b)
+        return ((b[0] << 8) | b[1],
+                (b[2] << 8) | b[3],
+                (b[4] << 8) | b[5],
+                (b[6] << 8) | b[7])
+
+    def measure_current_raw(self):
+        """Read the shunt register (no trigger) as current, in mA."""
+        raw = self.read_word(self.INA220_SV)
+        raw -= (raw & 0x8000) << 1
+        return raw * self._current_scale
+
+    def measure_current(self):
+        """Trigger and read the shunt current, in mA."""
+        self._trigger()
+        self._conversion_ready()
+        return self.measure_current_raw()
+
+
+class SupplyStats(object):
+    """Relay mux plus the two INA220 monitors.
+
+    A TCA9554 GPIO expander drives the set/reset coils of the latching
+    relays that steer one of V1/V2/V3 through the sense resistors.  The
+    coils are wired open-drain: configuring a pin as output drives the
+    coil, returning it to input releases it.  Pins 6/7 are the bypass
+    FETs and must be preserved across relay operations.
+    """
+    GPIO_ADDRESS = 0x38
+
+    GPIO_COMMAND_INPUT    = 0x00
+    GPIO_COMMAND_OUTPUT   = 0x01
+    GPIO_COMMAND_POLARITY = 0x02
+    GPIO_COMMAND_CONFIG   = 0x03
+
+    GPIO_BYPASS_MASK = 0xC0  # pins 6/7
+
+    CHANNELS = ["V1", "V2", "V3"]
+    V1_RELAY_SHIFT = 0
+    V2_RELAY_SHIFT = 2
+    V3_RELAY_SHIFT = 4
+    _CHANNEL_SHIFTS = {
+        CHANNELS[0]: V1_RELAY_SHIFT,
+        CHANNELS[1]: V2_RELAY_SHIFT,
+        CHANNELS[2]: V3_RELAY_SHIFT,
+    }
+    GPIO_LATCH_SET_MASK   = 0x1  # set coil, low bit of the pair
+    GPIO_LATCH_CLEAR_MASK = 0x3  # both coils of the pair
+
+    # latching relay set/reset coil pulse width; the datasheet minimum
+    # is 3ms, 5ms gives margin
+    RELAY_PULSE_MS = 5
+
+    INA220_HI_ADDRESS = 0x40
+    INA220_LO_ADDRESS = 0x41
+    RSENSE_HI_OHMS = 0.1
+    RSENSE_LO_OHMS = 10.0
+
+    def __init__(self, i2c):
+        self._i2c = i2c
+        self._addr = self.GPIO_ADDRESS
+        self._gpio_buf = bytearray(2)
+        if hasattr(i2c, "mem_read"):
+            self._GPIO_write = self._GPIO_write_pyb
+            self._GPIO_read = self._GPIO_read_pyb
+
+        self._GPIO_write(self.GPIO_COMMAND_OUTPUT, 0x00)
+        # only this class writes CONFIG, so shadow it and skip the
+        # read-modify-write readbacks
+        self._cfg_shadow = 0x00
+        self._config_write(0x00)
+
+        self.ina220_hi = INA220(i2c, self.INA220_HI_ADDRESS, "INA220_HI",
+                                rsense=self.RSENSE_HI_OHMS)
+        self.ina220_lo = INA220(i2c, self.INA220_LO_ADDRESS, "INA220_LO",
+                                rsense=self.RSENSE_LO_OHMS)
+
+    def _GPIO_write(self, command, value):
+        self._gpio_buf[0] = command & 0xff
+        self._gpio_buf[1] = value & 0xff
+        self._i2c.writeto(self._addr, self._gpio_buf)
+
+    def _GPIO_read(self, command):
+        # readfrom_mem issues the pointer write and the read as one
+        # repeated-START transaction instead of two transfers
+        return self._i2c.readfrom_mem(self._addr, command & 0xff, 1)[0]
+
+    def _GPIO_write_pyb(self, command, value):
+        self._i2c.mem_write(value & 0xff, self._addr, command & 0xff)
+
+    def _GPIO_read_pyb(self, command):
+        return self._i2c.mem_read(1, self._addr, command & 0xff)[0]
+
+    def _config_write(self, value):
+        self._cfg_shadow = value
+        self._GPIO_write(self.GPIO_COMMAND_CONFIG, value)
+
+    def _set_ina_channel(self, channel):
+        """Pulse the latching relay for channel, preserving bypass pins."""
+        shift = self._CHANNEL_SHIFTS.get(channel)
+        if shift is None:
+            print("_set_ina_channel: unknown channel {}".format(channel))
+            return False
+        reg_cache = self._cfg_shadow & self.GPIO_BYPASS_MASK
+        mask = self.GPIO_LATCH_CLEAR_MASK << shift
+        _reg_cache = reg_cache & ~mask
+        set_channel = (self.GPIO_LATCH_SET_MASK << shift) | _reg_cache
+
+        if DEBUG:
+            print("set_channel: {} 0x{:02x}".format(channel, set_channel))
+        self._config_write(set_channel)
+        utime.sleep_ms(self.RELAY_PULSE_MS)
+        # release the coil drive, back to inputs (bypass pins preserved)
+        self._config_write(reg_cache)
+        utime.sleep_ms(self.RELAY_PULSE_MS)
+        return True
+
+    def bypass(self, connect):
+        """Connect/disconnect the bypass FETs around the sense resistors."""
+        reg_cache = self._cfg_shadow
+        if DEBUG:
+            print("config_reg RESET: 0x{:02x}".format(reg_cache))
+        if connect:
+            value = reg_cache | self.GPIO_BYPASS_MASK
+        else:
+            value = reg_cache & ~self.GPIO_BYPASS_MASK
+        if DEBUG:
+            print("bypass: {} 0x{:02x}".format(connect, value))
+        self._config_write(value)
+        utime.sleep_ms(self.RELAY_PULSE_MS)
+        return True
+
+    def get_stats(self, channel):
+        """Switch the monitors onto channel and return its stats."""
+        if not self._set_ina_channel(channel):
+            return None
+        vshunt_mv, voltage_v = self.ina220_hi.read_sv_bv()
+        current_ma = vshunt_mv / self.ina220_hi.rsense
+        return {"channel": channel,
+                "voltage_mv": voltage_v * 1000.0,
+                "current_ua": current_ma * 1000.0}
+
+
+class LDO(object):
+    """Programmable LDO behind its own GPIO expander.
+
+    Pin 0 is the enable, pins 1-4 select the feedback divider tap.
+    """
+    GPIO_ADDRESS = 0x39
+
+    GPIO_COMMAND_INPUT    = 0x00
+    GPIO_COMMAND_OUTPUT   = 0x01
+    GPIO_COMMAND_POLARITY = 0x02
+    GPIO_COMMAND_CONFIG   = 0x03
+
+    LDO_ENABLE_MASK = 0x01
+    LDO_VSEL_MASK   = 0x1E
+
+    def __init__(self, i2c, name="LDO"):
+        self._i2c = i2c
+        self._addr = self.GPIO_ADDRESS
+        self.name = name
+        self._gpio_buf = bytearray(2)
+        if hasattr(i2c, "mem_read"):
+            self._GPIO_write = self._GPIO_write_pyb
+            self._GPIO_read = self._GPIO_read_pyb
+        self._GPIO_write(self.GPIO_COMMAND_OUTPUT, 0x00)
+        self._GPIO_write(self.GPIO_COMMAND_CONFIG, 0x00)
+
+    def _GPIO_write(self, command, value):
+        self._gpio_buf[0] = command & 0xff
+        self._gpio_buf[1] = value & 0xff
+        self._i2c.writeto(self._addr, self._gpio_buf)
+
+    def _GPIO_read(self, command):
+        # readfrom_mem issues the pointer write and the read as one
+        # repeated-START transaction instead of two transfers
+        return self._i2c.readfrom_mem(self._addr, command & 0xff, 1)[0]
+
+    def _GPIO_write_pyb(self, command, value):
+        self._i2c.mem_write(value & 0xff, self._addr, command & 0xff)
+
+    def _GPIO_read_pyb(self, command):
+        return self._i2c.mem_read(1, self._addr, command & 0xff)[0]
+
+    def enable(self, on):
+        reg_cache = self._GPIO_read(self.GPIO_COMMAND_OUTPUT)
+        if on:
+            value = reg_cache | self.LDO_ENABLE_MASK
+        else:
+            value = reg_cache & ~self.LDO_ENABLE_MASK
+        if DEBUG:
+            print("{}: enable {} 0x{:02x}".format(self.name, on, value))
+        self._GPIO_write(self.GPIO_COMMAND_OUTPUT, value)
+        return True
+
+    def set_voltage(self, vsel):
+        reg_cache = self._GPIO_read(self.GPIO_COMMAND_OUTPUT)
+        value = (reg_cache & ~self.LDO_VSEL_MASK) | ((vsel << 1) & self.LDO_VSEL_MASK)
+        self._GPIO_write(self.GPIO_COMMAND_OUTPUT, value)
+        return True
+
+
+class Supplies(object):
+    """Top level container for the supplies board."""
+
+    def __init__(self, i2c):
+        self.stats = SupplyStats(i2c)
+        self.ldo = LDO(i2c)
+
+
+# REPL test blocks; guarded so importing this module costs nothing
+if __name__ == '__main__':
+    import pyb
+    from upyb_i2c import UPYB_I2C_HW_I2C1, UPYB_I2C_DEFAULT_FREQ
+
+    if True:
+        # pyb.I2C gives the drivers their mem_read/mem_write fast path
+        i2c = pyb.I2C(1, pyb.I2C.MASTER, baudrate=UPYB_I2C_DEFAULT_FREQ)
+        print(i2c.scan())
+        supplies = Supplies(i2c)
+        for _ in range(4):
+            for _channel in SupplyStats.CHANNELS:
+                print(supplies.stats.get_stats(_channel))
+                utime.sleep_ms(1000)
+
+    if False:
+        i2c = machine.I2C(UPYB_I2C_HW_I2C1, freq=UPYB_I2C_DEFAULT_FREQ)
+        supplies = Supplies(i2c)
+        supplies.ldo.enable(True)
+        print(supplies.stats.get_stats(SupplyStats.CHANNELS[0]))
+        supplies.stats.bypass(True)
+        print(supplies.stats.get_stats(SupplyStats.CHANNELS[0]))
+        supplies.stats.bypass(False)
+        supplies.ldo.enable(False)